@@ -1,16 +1,22 @@
 from flask import Flask
-from blueprints.billboard_api import billboard_bp
+from blueprints.billboard_api import billboard_bp, AppleMusicService
 import os
+import logging
 from cache_extension import cache
 
 def create_app():
+    # Configure logging once for the whole process; basicConfig is a no-op if already configured
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+    
     # Create app
     app = Flask(__name__)
     
     # Configure cache for Redis Labs
     cache_config = {
-        "CACHE_TYPE": "RedisCache",
+        "CACHE_TYPE": "cache_extension.OrjsonRedisCache",
         "CACHE_REDIS_URL": os.environ.get("REDIS_URL"),
+        "CACHE_KEY_PREFIX": os.environ.get("CACHE_KEY_PREFIX", "flask_cache_"),
+        "CACHE_REDIS_MAX_CONNECTIONS": 50,  # Per worker - enough for a full parallel Apple Music enrichment
         "CACHE_DEFAULT_TIMEOUT": 3600  # 1 hour
     }
     app.config.update(cache_config)
@@ -21,6 +27,9 @@ def create_app():
     # Register blueprint
     app.register_blueprint(billboard_bp)
     
+    # Pre-warm the Apple Music token so requests never pay for signing it
+    AppleMusicService.start_token_refresher(app)
+    
     return app
 
 # Create application instance
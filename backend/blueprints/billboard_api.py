@@ -1,16 +1,25 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, request
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import logging
 from dotenv import load_dotenv
-from cache_extension import cache
+from cache_extension import cache, acquire_lock, release_lock, encoded_value, expire
 from datetime import datetime, timedelta
 import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+import orjson
+from cachetools import TTLCache
+from cachetools.keys import hashkey
 import concurrent.futures
+import functools
 import re
+import random
+import threading
+import time
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the app (see create_app)
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -22,74 +31,530 @@ APPLE_MUSIC_KEY_ID = os.getenv("APPLE_MUSIC_KEY_ID")
 APPLE_MUSIC_TEAM_ID = os.getenv("APPLE_MUSIC_TEAM_ID")
 APPLE_MUSIC_AUTH_KEY = os.getenv("APPLE_MUSIC_AUTH_KEY")
 
+# Per-process copy of the rate limit flag (see is_rate_limited)
+_rate_limit_state = {"value": False, "expires": 0.0}
+
+# Weekday for the current minute (see weekday_now)
+_weekday_state = {"minute": None, "weekday": None}
+
+# Per-process copy of the Apple Music token (see AppleMusicService.get_token)
+_token_state = {"token": None, "expires": 0.0}
+_token_lock = threading.Lock()
+
+# Parsed Apple Music private key, loaded on first use (see AppleMusicService._signing_key)
+_apple_music_signing_key = None
+
+# Background thread keeping the Apple Music token fresh (see start_token_refresher)
+_token_refresher = None
+
 # Create blueprint with prefix
 # No URL prefix means routes will be registered at the root path
 billboard_bp = Blueprint('billboard', __name__, url_prefix='')
 
+# Upstream API endpoints
+BILLBOARD_API_URL = "https://billboard-charts-api.p.rapidapi.com/chart.php"
+APPLE_MUSIC_SEARCH_URL = "https://api.music.apple.com/v1/catalog/us/search"
+
+# Apple Music artwork URL size placeholder, e.g. ".../{w}x{h}bb.jpg"
+ARTWORK_SIZE_PATTERN = re.compile(r"\{w\}x\{h\}(bb\.(?:jpg|png|webp))")
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Pre-encoded cache flags spliced onto serialized charts (see splice_json)
+CACHED_FIELDS = orjson.dumps({"cached": True})
+FRESH_FIELDS = orjson.dumps({"cached": False})
+
 # Constants for cache timeouts and rate limiting
 ONE_HOUR = 3600
 ONE_WEEK = 604800
 RATE_LIMIT_TIMEOUT = 300  # 5 minutes - how long to wait when rate limited
+RATE_LIMIT_KEY = "billboard:rate_limited"
+RATE_LIMIT_LOCAL_TIMEOUT = 10  # How long each worker trusts its copy of the rate limit flag
+BILLBOARD_API_TIMEOUT = 5  # Seconds per attempt to connect to, or read from, the Billboard API
+API_RETRIES = 2  # Retries of connection failures and gateway errors (see create_session)
+REFRESH_WAIT_INTERVAL = 0.25  # How often requests waiting on another request's fetch check the cache
+MAX_RESPONSE_BYTES = 5 * 1024 * 1024  # 5 MB - refuse upstream bodies far larger than any chart
+RESPONSE_CHUNK_SIZE = 64 * 1024
+TTL_JITTER = 0.05  # Spread expiries by +/-5% so charts don't all expire together
 APPLE_MUSIC_TOKEN_TIMEOUT = 11 * 3600  # 11 hours - token expires after 12 hours, refreshing slightly early
+APPLE_MUSIC_TOKEN_REFRESH_MARGIN = 2 * 3600  # 2 hours - re-sign in the background an hour before the cached token's entry expires
+APPLE_MUSIC_TOKEN_RETRY_INTERVAL = 60  # How soon the refresher checks again after signing failed or another worker was signing
+APPLE_MUSIC_TOKEN_KEY = "apple_music:token"
+APPLE_MUSIC_TOKEN_LOCK_KEY = "apple_music:token:lock"
+APPLE_MUSIC_TOKEN_LOCK_TIMEOUT = 30
+APPLE_MUSIC_TOKEN_WAIT_ATTEMPTS = 20  # Wait up to 2 seconds for another worker's token
+APPLE_MUSIC_TOKEN_WAIT_INTERVAL = 0.1
+APPLE_MUSIC_TOKEN_LOCAL_MARGIN = 60  # Stop using this worker's copy of the token a minute before it expires
+APPLE_MUSIC_SEARCH_TIMEOUT = 24 * 3600  # 24 hours - how long to cache search results
+APPLE_MUSIC_FAILURE_TIMEOUT = 300  # 5 minutes - how long to cache failed searches
+APPLE_MUSIC_ENRICH_TIMEOUT = 8  # Stop waiting for outstanding lookups so one chart refresh fits in its lock
+APPLE_MUSIC_LOCAL_TIMEOUT = 600  # 10 minutes - how long each worker keeps search results in memory
+APPLE_MUSIC_LOCAL_MAXSIZE = 2048  # Enough for every song on the popular charts
+APPLE_MUSIC_MAX_WORKERS = int(os.getenv("APPLE_MUSIC_MAX_WORKERS", 50))  # Parallel Apple Music lookups - matches the session's connection pool
+
+# Refresh timing, worked back from gunicorn's default 30 second worker timeout
+# (render.yaml runs plain `gunicorn app:app`)
+WORKER_TIMEOUT = 30
+# Slowest possible refresh: every Billboard attempt times out, then enrichment runs to its deadline
+REFRESH_FETCH_TIMEOUT = BILLBOARD_API_TIMEOUT * (API_RETRIES + 1) + APPLE_MUSIC_ENRICH_TIMEOUT
+REFRESH_LOCK_TIMEOUT = REFRESH_FETCH_TIMEOUT + 5  # Outlives the slowest refresh, so it never expires under its holder
+# Requests with nothing cached wait this long for another request's fetch before making
+# their own, so waiting and then fetching still fits in the worker timeout
+REFRESH_WAIT_TIMEOUT = WORKER_TIMEOUT - REFRESH_FETCH_TIMEOUT - 2
+
+# Per-process copy of recent Apple Music search results (see AppleMusicService.local_search_result)
+_am_local = TTLCache(maxsize=APPLE_MUSIC_LOCAL_MAXSIZE, ttl=APPLE_MUSIC_LOCAL_TIMEOUT)
+_am_local_lock = threading.Lock()
+_MISSING = object()
+
+# Long-lived pool for Apple Music lookups, shared by every request in this worker.
+# Threads are only started on first use, so each gunicorn worker gets its own.
+_apple_music_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=APPLE_MUSIC_MAX_WORKERS,
+    thread_name_prefix="apple-music"
+)
+
+# ================= HTTP Sessions =================
+
+def create_session(pool_size):
+    """
+    Create a requests Session that keeps connections alive between calls.
+    
+    Reusing pooled connections skips the TCP and TLS handshake on every
+    request, which matters most when enriching a chart with dozens of
+    parallel Apple Music lookups. The pool never blocks: requests can't
+    bound the wait for a free connection, so a leaked one would hang the
+    caller forever. When every pooled connection is busy an extra one is
+    opened and discarded after use instead.
+    
+    Args:
+        pool_size (int): Maximum number of connections to keep per host
+        
+    Returns:
+        requests.Session: Session with a pooled, retrying HTTPS adapter
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        # Retry transient connection failures and gateway errors; the final
+        # response is still returned so raise_for_status() handles it as before
+        max_retries=Retry(
+            total=API_RETRIES,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+            # A long Retry-After would stall the request past REFRESH_FETCH_TIMEOUT
+            respect_retry_after_header=False
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+# Shared sessions are thread-safe for the parallel enrichment requests
+billboard_session = create_session(pool_size=10)
+# RapidAPI headers never change, so send them with every request by default
+billboard_session.headers.update({
+    "X-RapidAPI-Key": api_key,
+    "X-RapidAPI-Host": "billboard-charts-api.p.rapidapi.com"
+})
+# Lookups only run on _apple_music_pool, which has one thread per pooled connection
+apple_music_session = create_session(pool_size=APPLE_MUSIC_MAX_WORKERS)
+
+def jittered_timeout(timeout):
+    """
+    Randomize a cache timeout slightly so keys set together don't expire in lockstep.
+    
+    Args:
+        timeout (int): The nominal timeout in seconds
+        
+    Returns:
+        int: The timeout adjusted by up to +/- TTL_JITTER
+    """
+    return int(timeout * random.uniform(1 - TTL_JITTER, 1 + TTL_JITTER))
+
+def is_rate_limited():
+    """
+    Check whether the Billboard API is currently rate limiting us.
+    
+    The flag lives in the shared cache, but each worker keeps its own copy for
+    RATE_LIMIT_LOCAL_TIMEOUT seconds so most requests skip the cache round trip.
+    
+    Returns:
+        bool: True if we're rate limited
+    """
+    if time.monotonic() < _rate_limit_state["expires"]:
+        return _rate_limit_state["value"]
+    
+    value = bool(cache.get(RATE_LIMIT_KEY))
+    _rate_limit_state.update(value=value, expires=time.monotonic() + RATE_LIMIT_LOCAL_TIMEOUT)
+    return value
+
+def set_rate_limited(value):
+    """
+    Set or clear the shared rate limit flag and this worker's copy of it.
+    
+    Args:
+        value (bool): True to flag that we're rate limited, False to clear it
+    """
+    if value:
+        cache.set(RATE_LIMIT_KEY, True, timeout=RATE_LIMIT_TIMEOUT)
+    else:
+        cache.delete(RATE_LIMIT_KEY)
+    _rate_limit_state.update(value=value, expires=time.monotonic() + RATE_LIMIT_LOCAL_TIMEOUT)
+
+def weekday_now():
+    """
+    Get today's weekday, working it out from the clock at most once a minute.
+    
+    Returns:
+        int: The weekday, where Monday is 0 and Sunday is 6
+    """
+    minute = int(time.time() // 60)
+    if _weekday_state["minute"] != minute:
+        _weekday_state.update(minute=minute, weekday=datetime.now().weekday())
+    return _weekday_state["weekday"]
+
+def clear_local_caches():
+    """Forget all per-process cached state, e.g. between tests."""
+    global _apple_music_signing_key
+    _apple_music_signing_key = None
+    _rate_limit_state.update(value=False, expires=0.0)
+    _token_state.update(token=None, expires=0.0)
+    _weekday_state.update(minute=None, weekday=None)
+    with _am_local_lock:
+        _am_local.clear()
+
+def read_json(response, max_bytes=MAX_RESPONSE_BYTES):
+    """
+    Read a streamed upstream response into one buffer and parse it with orjson.
+    
+    Decoding the raw bytes skips the intermediate str copy that
+    response.json() makes, and reading in chunks lets oversized bodies be
+    rejected before they are fully buffered. The caller owns the response
+    and must close it, so its connection goes back to the pool on every path.
+    
+    Args:
+        response (requests.Response): A response requested with stream=True
+        max_bytes (int): Largest body accepted
+        
+    Returns:
+        The parsed JSON body
+        
+    Raises:
+        ValueError: If the body is too large or isn't valid JSON
+    """
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ValueError(f"Upstream response exceeds {max_bytes} bytes")
+    return orjson.loads(body)
+
+def splice_json(body, fields):
+    """
+    Merge one serialized JSON object's fields into another without decoding either.
+    
+    Args:
+        body (bytes): The serialized JSON object
+        fields (bytes): A serialized JSON object whose keys aren't already in body
+        
+    Returns:
+        bytes: The combined JSON object
+    """
+    if body == b"{}":
+        return fields
+    return body[:-1] + b"," + fields[1:]
+
+def extend_json(body, **fields):
+    """
+    Add top-level fields to a serialized JSON object without decoding it.
+    
+    Splicing the encoded fields in before the closing brace avoids copying
+    and re-encoding a whole chart just to flag it as cached or add a note.
+    
+    Args:
+        body (bytes): The serialized JSON object
+        **fields: Fields to add, which must not already be in the object
+        
+    Returns:
+        bytes: The extended JSON object
+    """
+    return splice_json(body, orjson.dumps(fields))
+
+def json_response(obj, status=200):
+    """
+    Build a JSON response encoded with orjson.
+    
+    orjson is a compiled encoder and is several times faster than the stdlib
+    json used by jsonify on large enriched chart payloads.
+    
+    Args:
+        obj: The JSON-serializable response data
+        status (int): The HTTP status code
+        
+    Returns:
+        Response: The JSON response
+    """
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def cache_chart(cache_key, data, timeout, enriched):
+    """
+    Cache chart data, plus its serialized response body when it is enriched.
+    
+    The body is stored pre-encoded as a cached response so that hits can be
+    returned without decoding the chart and encoding it to JSON again. The
+    chart is encoded once: the same bytes are cached as the chart itself and
+    spliced into the body. The chart date is also kept under its own small
+    key, so Tuesday update checks can compare dates without loading the whole
+    cached chart.
+    
+    Args:
+        cache_key (str): The chart cache key
+        data (dict): The chart data to cache
+        timeout (int): Cache timeout in seconds, or 0 to never expire
+        enriched (bool): Whether the data includes Apple Music info
+        
+    Returns:
+        bytes: The chart serialized as JSON, for building the response
+    """
+    body_key = f"{cache_key}:json"
+    encoded = orjson.dumps(data)
+    mapping = {cache_key: encoded_value(data, encoded)}
+    
+    chart_date = data.get("chart", {}).get("date")
+    if chart_date:
+        mapping[f"{cache_key}:date"] = chart_date
+    
+    if enriched:
+        mapping[body_key] = splice_json(encoded, CACHED_FIELDS)
+    cache.set_many(mapping, timeout=timeout)
+    
+    if not enriched:
+        # Don't leave an older enriched body behind for this chart
+        cache.delete(body_key)
+    return encoded
 
 # ================= Apple Music Service =================
 
 class AppleMusicService:
     @staticmethod
-    def get_token():
+    def get_token(force=False):
         """
         Get a cached Apple Music token or generate a new one.
         
         The token is a JWT that lasts for 12 hours but we cache it for 11 hours
-        to ensure we refresh it before expiration.
+        to ensure we refresh it before expiration. Each process also keeps its
+        own copy until shortly before the token expires, so lookups don't need
+        a Redis round trip for it. Signing is guarded by a lock so only one
+        worker signs a new token while the others wait for it.
+        
+        Args:
+            force (bool): Sign a new token even if one is cached
         
         Returns:
             str: The Apple Music JWT token or None if generation fails
         """
-        cache_key = "apple_music:token"
-        token = cache.get(cache_key)
-        
-        if token:
-            return token
+        if not force and time.time() < _token_state["expires"]:
+            return _token_state["token"]
         
-        try:
-            # Generate a new token with a 12-hour expiration
-            time_now = datetime.now()
-            expiration_time = time_now + timedelta(hours=12)
+        # Parallel lookups in this process share one trip to Redis (or one signature)
+        with _token_lock:
+            if not force and time.time() < _token_state["expires"]:
+                return _token_state["token"]
             
-            # Define JWT headers as required by Apple Music API
-            headers = {
-                "alg": "ES256",  # Required algorithm
-                "kid": APPLE_MUSIC_KEY_ID  # Key identifier from Apple Developer account
-            }
+            cache_key = APPLE_MUSIC_TOKEN_KEY
+            if not force:
+                token = cache.get(cache_key)
+                if token:
+                    return AppleMusicService._remember_token(token)
             
-            # Define JWT payload as required by Apple Music API
-            payload = {
-                "iss": APPLE_MUSIC_TEAM_ID,  # Team ID from Apple Developer account
-                "iat": int(time_now.timestamp()),  # Issued at time
-                "exp": int(expiration_time.timestamp())  # Expiration time
-            }
+            lock_token = acquire_lock(APPLE_MUSIC_TOKEN_LOCK_KEY, APPLE_MUSIC_TOKEN_LOCK_TIMEOUT)
+            if not lock_token:
+                # Another worker is already signing - use its token once it's cached
+                token = AppleMusicService._wait_for_token()
+                if token:
+                    return AppleMusicService._remember_token(token)
+                if force:
+                    return None
             
-            # Generate the JWT token with ES256 algorithm
-            token = jwt.encode(
-                payload, 
-                APPLE_MUSIC_AUTH_KEY,  # Private key from Apple Developer account
-                algorithm='ES256',
-                headers=headers
-            )
+            try:
+                token = AppleMusicService._sign_token()
+                
+                # Cache the token for slightly less than its full lifetime
+                cache.set(cache_key, token, timeout=APPLE_MUSIC_TOKEN_TIMEOUT)
+                return AppleMusicService._remember_token(token)
+            except Exception as e:
+                logger.error(f"Error generating Apple Music token: {e}")
+                return None
+            finally:
+                if lock_token:
+                    release_lock(APPLE_MUSIC_TOKEN_LOCK_KEY, lock_token)
+    
+    @staticmethod
+    def _remember_token(token):
+        """
+        Keep a copy of the token in this process until just before it expires.
+        
+        Args:
+            token (str): The signed Apple Music JWT
             
-            # Cache the token for slightly less than its full lifetime
-            cache.set(cache_key, token, timeout=APPLE_MUSIC_TOKEN_TIMEOUT)
-            return token
-        except Exception as e:
-            logger.error(f"Error generating Apple Music token: {e}")
+        Returns:
+            str: The same token
+        """
+        claims = jwt.decode(token, options={"verify_signature": False})
+        _token_state.update(token=token, expires=claims["exp"] - APPLE_MUSIC_TOKEN_LOCAL_MARGIN)
+        return token
+    
+    @staticmethod
+    def _sign_token():
+        """
+        Sign a new Apple Music JWT with a 12-hour expiration.
+        
+        Returns:
+            str: The signed JWT token
+        """
+        time_now = datetime.now()
+        expiration_time = time_now + timedelta(hours=12)
+        
+        # Define JWT headers as required by Apple Music API
+        headers = {
+            "alg": "ES256",  # Required algorithm
+            "kid": APPLE_MUSIC_KEY_ID  # Key identifier from Apple Developer account
+        }
+        
+        # Define JWT payload as required by Apple Music API
+        payload = {
+            "iss": APPLE_MUSIC_TEAM_ID,  # Team ID from Apple Developer account
+            "iat": int(time_now.timestamp()),  # Issued at time
+            "exp": int(expiration_time.timestamp())  # Expiration time
+        }
+        
+        # Generate the JWT token with ES256 algorithm
+        return jwt.encode(
+            payload, 
+            AppleMusicService._signing_key(),  # Private key from Apple Developer account
+            algorithm='ES256',
+            headers=headers
+        )
+    
+    @staticmethod
+    def _signing_key():
+        """
+        Parse the Apple Music private key once and reuse it for every signature.
+        
+        PyJWT would otherwise re-parse the PEM on every call to jwt.encode,
+        which costs far more than the signature itself.
+        
+        Returns:
+            EllipticCurvePrivateKey: The loaded private key
+        """
+        global _apple_music_signing_key
+        if _apple_music_signing_key is None:
+            _apple_music_signing_key = load_pem_private_key(APPLE_MUSIC_AUTH_KEY.encode(), password=None)
+        return _apple_music_signing_key
+    
+    @staticmethod
+    def _wait_for_token():
+        """
+        Poll the cache briefly for a token being signed by another worker.
+        
+        Returns:
+            str: The cached token, or None if it didn't appear in time
+        """
+        for _ in range(APPLE_MUSIC_TOKEN_WAIT_ATTEMPTS):
+            time.sleep(APPLE_MUSIC_TOKEN_WAIT_INTERVAL)
+            token = cache.get(APPLE_MUSIC_TOKEN_KEY)
+            if token:
+                return token
+        return None
+    
+    @staticmethod
+    def start_token_refresher(app, margin=APPLE_MUSIC_TOKEN_REFRESH_MARGIN):
+        """
+        Keep the cached Apple Music token fresh from a background thread.
+        
+        Re-signing the token before the cached one expires keeps the ES256
+        signing off the request path. Only one refresher runs per process.
+        Each one sleeps until the shared token is close to expiry, so workers
+        adopt each other's tokens rather than each signing on a timer.
+        
+        Args:
+            app (Flask): The app whose cache the token is stored in
+            margin (int): Re-sign once the cached token has this many seconds left
+            
+        Returns:
+            threading.Thread: The refresher thread, or None if not started
+        """
+        global _token_refresher
+        if _token_refresher is not None:
+            return _token_refresher
+        if not all([APPLE_MUSIC_KEY_ID, APPLE_MUSIC_TEAM_ID, APPLE_MUSIC_AUTH_KEY]):
+            logger.warning("Apple Music credentials missing, token refresher not started")
             return None
         
+        def refresh_token():
+            while True:
+                delay = APPLE_MUSIC_TOKEN_RETRY_INTERVAL
+                try:
+                    with app.app_context():
+                        delay = AppleMusicService._refresh_cached_token(margin)
+                except Exception as e:
+                    logger.error(f"Error refreshing Apple Music token: {e}")
+                time.sleep(delay)
+        
+        _token_refresher = threading.Thread(target=refresh_token, name="apple-music-token-refresher", daemon=True)
+        _token_refresher.start()
+        return _token_refresher
+        
+    @staticmethod
+    def _refresh_cached_token(margin):
+        """
+        Re-sign the shared token if it is missing or close to expiry.
+        
+        A token with more than margin seconds left is adopted as it is, so
+        only the first worker to wake near expiry signs a new one.
+        
+        Args:
+            margin (int): Re-sign once the cached token has this many seconds left
+            
+        Returns:
+            int: Seconds until the token should be checked again
+        """
+        token = cache.get(APPLE_MUSIC_TOKEN_KEY)
+        if token and AppleMusicService._seconds_left(token) > margin:
+            AppleMusicService._remember_token(token)
+        else:
+            token = AppleMusicService.get_token(force=True)
+        
+        if not token:
+            return APPLE_MUSIC_TOKEN_RETRY_INTERVAL
+        # Jittered so workers that adopted the same token don't all wake at once
+        delay = jittered_timeout(AppleMusicService._seconds_left(token) - margin)
+        return max(delay, APPLE_MUSIC_TOKEN_RETRY_INTERVAL)
+    
+    @staticmethod
+    def _seconds_left(token):
+        """
+        Get how long a signed token has until it expires.
+        
+        Args:
+            token (str): The Apple Music JWT
+            
+        Returns:
+            float: Seconds until the token's exp claim
+        """
+        claims = jwt.decode(token, options={"verify_signature": False})
+        return claims["exp"] - time.time()
+    
     @staticmethod
     def standardize_artwork_url(url):
         """
         Standardize artwork URL to always use 1000x1000 dimensions.
         
+        Search results are standardized once before they're cached, so cached
+        results and enriched charts never need to be standardized again.
+        
         Args:
             url (str): The artwork URL to standardize
                 
@@ -100,7 +565,7 @@ class AppleMusicService:
             return url
             
         # Replace {w}x{h} placeholders with 1000x1000
-        return url.replace("{w}x{h}bb.jpg", "1000x1000bb.jpg")
+        return ARTWORK_SIZE_PATTERN.sub(r"1000x1000\1", url)
     
     @staticmethod
     def search_song(title, artist):
@@ -114,34 +579,120 @@ class AppleMusicService:
         Returns:
             dict: Song details including ID, URL, preview URL, and artwork URL, or None if not found
         """
-        # Create a cache key using both title and artist to ensure uniqueness
-        cache_key = f"apple_music:search:{title}:{artist}"
+        # The normalized text only keys the caches - the search itself uses the original
+        key_title, key_artist = AppleMusicService.normalize(title), AppleMusicService.normalize(artist)
+        
+        local_result = AppleMusicService.local_search_result(key_title, key_artist)
+        if local_result is not _MISSING:
+            return local_result
+        
+        cache_key = AppleMusicService.search_cache_key(key_title, key_artist)
         cached_result = cache.get(cache_key)
         
         if cached_result is not None:  # Allow caching of None results too
-            # Always standardize artwork URL for cached results
-            if cached_result and "artwork_url" in cached_result:
-                cached_result["artwork_url"] = AppleMusicService.standardize_artwork_url(cached_result["artwork_url"])
+            AppleMusicService.store_local_search_result(key_title, key_artist, cached_result)
             return cached_result
         
+        result, timeout = AppleMusicService._search_api(title, artist)
+        if timeout:
+            cache.set(cache_key, result, timeout=timeout)
+        if timeout == APPLE_MUSIC_SEARCH_TIMEOUT:
+            AppleMusicService.store_local_search_result(key_title, key_artist, result)
+        return result
+    
+    @staticmethod
+    def local_search_result(title, artist):
+        """
+        Look up a search result in this worker's in-memory cache.
+        
+        Popular songs appear on almost every chart request, so keeping them
+        in memory skips the Redis round trip and deserialization entirely.
+        
+        Args:
+            title (str): The song title
+            artist (str): The artist name
+            
+        Returns:
+            dict: The cached song details (possibly None), or _MISSING if not cached locally
+        """
+        with _am_local_lock:
+            return _am_local.get(hashkey(title, artist), _MISSING)
+    
+    @staticmethod
+    def store_local_search_result(title, artist, result):
+        """Keep a search result in this worker's in-memory cache."""
+        with _am_local_lock:
+            _am_local[hashkey(title, artist)] = result
+    
+    @staticmethod
+    def normalize(text):
+        """
+        Normalize a title or artist so trivial variations share one cached search.
+        
+        Lowercases the text and collapses whitespace, so e.g. "Song  Title"
+        and "song title" hit the same cached result, including cached "not
+        found" results. Parentheticals are kept: "(Remix)" or "(Taylor's
+        Version)" name a different recording, with its own Apple Music match.
+        Only cache and dedupe keys use this - searches send the original text.
+        
+        Args:
+            text (str): The song title or artist name
+            
+        Returns:
+            str: The normalized text
+        """
+        return WHITESPACE_PATTERN.sub(" ", (text or "").lower()).strip()
+    
+    @staticmethod
+    def search_cache_key(title, artist):
+        """
+        Build the cache key for an Apple Music search.
+        
+        Args:
+            title (str): The normalized song title
+            artist (str): The normalized artist name
+            
+        Returns:
+            str: Cache key using both title and artist to ensure uniqueness
+        """
+        return f"apple_music:search:{title}:{artist}"
+    
+    @staticmethod
+    def _search_api(title, artist):
+        """
+        Query the Apple Music search API.
+        
+        The result isn't cached here so callers can batch their cache writes.
+        
+        Args:
+            title (str): The song title to search for
+            artist (str): The artist name to search for
+            
+        Returns:
+            tuple: (song details or None, how long to cache the result in seconds,
+                or None if it shouldn't be cached)
+        """
         token = AppleMusicService.get_token()
         if not token:
-            return None
+            return None, None
             
         try:
-            url = "https://api.music.apple.com/v1/catalog/us/search"
-            headers = {"Authorization": f"Bearer {token}"}
-            search_term = f"{title} {artist}"
-            
             params = {
-                'term': search_term,
+                'term': f"{title} {artist}",
                 'types': 'songs',
                 'limit': 1
             }
             
-            response = requests.get(url, headers=headers, params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
+            # Closing the response returns its connection to the pool, even for error statuses
+            with apple_music_session.get(
+                APPLE_MUSIC_SEARCH_URL,
+                headers={"Authorization": f"Bearer {token}"},
+                params=params,
+                timeout=5,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                data = read_json(response)
             
             # Extract song information and standardize artwork URL
             result = None
@@ -157,75 +708,231 @@ class AppleMusicService:
                 }
             
             # Cache results for 24 hours
-            cache.set(cache_key, result, timeout=24*60*60)
-            return result
+            return result, APPLE_MUSIC_SEARCH_TIMEOUT
             
         except Exception as e:
             logger.error(f"Error searching Apple Music: {e}")
             # Cache failures briefly to prevent immediate retries
-            cache.set(cache_key, None, timeout=300)
-            return None    
+            return None, APPLE_MUSIC_FAILURE_TIMEOUT
+    
+    @staticmethod
+    def get_songs(data):
+        """
+        Get the list of songs from chart data in either supported format.
+        
+        Args:
+            data (dict): Billboard chart data
+            
+        Returns:
+            list: The chart entries or songs, or None if the format is unknown
+        """
+        if "chart" in data and "entries" in data["chart"]:
+            return data["chart"]["entries"]
+        if "songs" in data:
+            return data["songs"]
+        return None
+    
+    @staticmethod
+    def is_enriched(data):
+        """
+        Check whether every song on a chart carries Apple Music info.
+        
+        Lookups still outstanding when enrichment times out leave their songs
+        without an apple_music field, anywhere on the chart, so every song is
+        checked.
+        
+        Args:
+            data (dict): Billboard chart data
+            
+        Returns:
+            bool: True if every song has an apple_music field
+        """
+        songs = AppleMusicService.get_songs(data) if data else None
+        return bool(songs) and all("apple_music" in song for song in songs)
     
     @staticmethod
     def enrich_chart_data(data):
         """
-        Add Apple Music data to chart entries and standardize artwork URLs.
+        Add Apple Music data to chart entries.
         
         Args:
             data (dict): Billboard chart data to enrich
             
         Returns:
-            dict: The chart data with standardized artwork URLs and Apple Music info
+            tuple: (the chart data with Apple Music info, whether every song
+                now has it - False if some lookups were still outstanding)
         """
         if not data:
-            return data
+            return data, False
             
         # Determine the song list structure
-        songs = []
-        if "chart" in data and "entries" in data["chart"]:
-            songs = data["chart"]["entries"]
-        elif "songs" in data:
-            songs = data["songs"]
-        else:
-            return data
+        songs = AppleMusicService.get_songs(data)
+        if songs is None:
+            return data, False
         
-        # First, standardize artwork URLs for existing Apple Music data
-        for song in songs:
-            if "apple_music" in song and song["apple_music"] and "artwork_url" in song["apple_music"]:
-                song["apple_music"]["artwork_url"] = AppleMusicService.standardize_artwork_url(song["apple_music"]["artwork_url"])
-            
-        # If songs already have Apple Music data, we're done
-        if songs and all("apple_music" in song for song in songs):
-            return data
-            
-        # Process songs that don't have Apple Music data
+        # Process songs that don't have Apple Music data - if none are left, we're done
         songs_to_process = [s for s in songs if "apple_music" not in s]
         
         if not songs_to_process:
-            return data
-            
+            return data, bool(songs)
+        
+        complete = True
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                # Map songs to their titles and artists
-                song_data = [(s.get("title", s.get("name")), s.get("artist")) for s in songs_to_process]
+            # Songs repeated on a chart (re-entries, differently spaced or cased titles) are looked up once
+            unique_songs = {}
+            for song in songs_to_process:
+                key = (AppleMusicService.normalize(song.get("title", song.get("name"))), AppleMusicService.normalize(song.get("artist")))
+                unique_songs.setdefault(key, []).append(song)
+            
+            # Serve songs this worker looked up recently straight from memory
+            remote = []
+            for (title, artist), songs_with_key in unique_songs.items():
+                local_result = AppleMusicService.local_search_result(title, artist)
+                if local_result is not _MISSING:
+                    for song in songs_with_key:
+                        song["apple_music"] = local_result
+                else:
+                    remote.append((songs_with_key, title, artist, AppleMusicService.search_cache_key(title, artist)))
+            
+            # Fetch every other cached search result in a single round trip (MGET)
+            cached_results = cache.get_many(*[cache_key for _, _, _, cache_key in remote]) if remote else []
+            
+            misses = []
+            for (songs_with_key, title, artist, cache_key), cached_result in zip(remote, cached_results):
+                if cached_result is not None:
+                    for song in songs_with_key:
+                        song["apple_music"] = cached_result
+                    AppleMusicService.store_local_search_result(title, artist, cached_result)
+                else:
+                    misses.append((songs_with_key, title, artist, cache_key))
+            
+            if misses:
+                # Only search the API for songs missing from the cache, in parallel on the shared pool,
+                # using the first matching song's original title and artist
+                futures = {
+                    _apple_music_pool.submit(
+                        AppleMusicService._search_api,
+                        songs_with_key[0].get("title", songs_with_key[0].get("name")),
+                        songs_with_key[0].get("artist")
+                    ): (songs_with_key, title, artist, cache_key)
+                    for songs_with_key, title, artist, cache_key in misses
+                }
                 
-                # Search for each song in parallel
-                apple_music_results = list(executor.map(
-                    lambda x: AppleMusicService.search_song(*x), 
-                    song_data
-                ))
+                # Add results back to songs as each lookup finishes, grouping cache writes by timeout
+                to_cache = {}
+                try:
+                    for future in concurrent.futures.as_completed(futures, timeout=APPLE_MUSIC_ENRICH_TIMEOUT):
+                        songs_with_key, title, artist, cache_key = futures[future]
+                        try:
+                            result, timeout = future.result()
+                        except Exception as e:
+                            logger.error(f"Error searching Apple Music for {title} by {artist}: {e}")
+                            result, timeout = None, None
+                        
+                        for song in songs_with_key:
+                            song["apple_music"] = result
+                        if timeout:
+                            to_cache.setdefault(timeout, {})[cache_key] = result
+                        # Failed searches only stay cached briefly, so keep them out of memory
+                        if timeout == APPLE_MUSIC_SEARCH_TIMEOUT:
+                            AppleMusicService.store_local_search_result(title, artist, result)
+                except concurrent.futures.TimeoutError:
+                    # Songs still waiting keep no apple_music key, so callers cache the chart only
+                    # briefly. Their lookups carry on and cache the results once they finish.
+                    pending = [future for future in futures if not future.done()]
+                    complete = not pending
+                    backend = cache.cache
+                    for future in pending:
+                        _, title, artist, cache_key = futures[future]
+                        future.add_done_callback(functools.partial(
+                            AppleMusicService._cache_late_result, backend, title, artist, cache_key
+                        ))
+                    logger.warning(f"Apple Music enrichment timed out with {len(pending)} lookups outstanding")
                 
-                # Add results back to songs
-                for song, result in zip(songs_to_process, apple_music_results):
-                    song["apple_music"] = result
+                # Write all new results back in one pipeline per timeout
+                for timeout, mapping in to_cache.items():
+                    cache.set_many(mapping, timeout=timeout)
                     
         except Exception as e:
             logger.error(f"Error enriching chart data with Apple Music: {e}")
+            complete = False
             
-        return data
+        return data, complete
+    
+    @staticmethod
+    def _cache_late_result(backend, title, artist, cache_key, future):
+        """
+        Cache the result of a lookup that finished after enrichment timed out.
+        
+        Runs on the lookup's pool thread, outside the request's app context,
+        so the cache backend is passed in instead of going through the cache
+        proxy.
+        
+        Args:
+            backend (BaseCache): The cache backend to write to
+            title (str): The normalized song title
+            artist (str): The normalized artist name
+            cache_key (str): The search result cache key
+            future (concurrent.futures.Future): The finished lookup
+        """
+        try:
+            result, timeout = future.result()
+        except Exception as e:
+            logger.error(f"Error searching Apple Music for {title} by {artist}: {e}")
+            return
+        
+        if timeout:
+            backend.set(cache_key, result, timeout=timeout)
+        if timeout == APPLE_MUSIC_SEARCH_TIMEOUT:
+            AppleMusicService.store_local_search_result(title, artist, result)
 
 # ================= Billboard API Route =================
 
+def serve_cached(cached_data, include_apple_music, note=None):
+    """
+    Build a response from cached chart data, if there is any.
+    
+    Args:
+        cached_data (dict): The cached chart data, or None
+        include_apple_music (bool): Whether to add Apple Music data if it's missing
+        note (str): Optional note explaining why cached data is served
+        
+    Returns:
+        Response: The cached chart response, or None if there's no cached data
+    """
+    if not cached_data:
+        return None
+    
+    # Add Apple Music data if requested and not already present
+    if include_apple_music and not AppleMusicService.is_enriched(cached_data):
+        cached_data, _ = AppleMusicService.enrich_chart_data(cached_data)
+    
+    # Flag the response in place - the dict is discarded afterwards, so don't copy it
+    cached_data["cached"] = True
+    if note:
+        cached_data["note"] = note
+    return json_response(cached_data)
+
+def wait_for_chart(cache_key, lock_key):
+    """
+    Wait for the request holding a chart's refresh lock to cache the chart.
+    
+    Args:
+        cache_key (str): The chart cache key
+        lock_key (str): The chart's refresh lock key
+        
+    Returns:
+        dict: The newly cached chart, or None if the fetch failed or took
+            longer than REFRESH_WAIT_TIMEOUT
+    """
+    for _ in range(int(REFRESH_WAIT_TIMEOUT / REFRESH_WAIT_INTERVAL)):
+        time.sleep(REFRESH_WAIT_INTERVAL)
+        # Read the chart and the lock in one round trip (MGET)
+        chart, lock = cache.get_many(cache_key, lock_key)
+        if chart or not lock:
+            return chart
+    return None
+
 @billboard_bp.route('/billboard_api.php')
 def get_chart():
     """
@@ -254,96 +961,132 @@ def get_chart():
     # Create cache key - format: billboard:chart_id:week (if week provided)
     cache_key = f"billboard:{chart_id}" + (f":{week}" if week else "")
     
+    # It's Tuesday (when charts update) - check current charts for updates
+    check_for_update = not week and weekday_now() == 1
+    
+    # Usually answered from this worker's short-lived copy of the flag
+    rate_limited = is_rate_limited()
+    
+    if not refresh and (rate_limited or not check_for_update):
+        # Enriched charts are cached as a ready-to-send response body - serve it as is.
+        # It matches what serve_cached would build either way, as the cached chart
+        # is returned with its Apple Music data even when apple_music=false
+        body = cache.get(f"{cache_key}:json")
+        if body:
+            if rate_limited:
+                body = extend_json(body, note="API rate limited, serving cached data")
+            return Response(body, mimetype="application/json")
+    
+    # Tuesday update checks always call the API, so only the cached chart's date
+    # is needed up front - the full chart is loaded later only if it's served
+    date_key = f"{cache_key}:date"
+    cached_date = cache.get(date_key) if check_for_update and not rate_limited and not refresh else None
+    
     # Get cached data
-    cached_data = cache.get(cache_key)
+    cached_data = None if cached_date else cache.get(cache_key)
     
     # Determine if we need to fetch from API based on multiple conditions
     need_api_call = (
         refresh or  # Explicit refresh requested
-        not cached_data or  # No cached data exists
-        # It's Tuesday (when charts update) and we're not rate limited - check for updates
-        (not week and datetime.now().weekday() == 1 and not cache.get("billboard:rate_limited"))
+        not (cached_data or cached_date) or  # No cached data exists
+        # Check for updates unless we're rate limited
+        (check_for_update and not rate_limited)
     )
     
     # Use cached data if we have it and don't need to refresh
     if not need_api_call and cached_data:
-        # Add Apple Music data if requested and not already present
-        if include_apple_music:
-            cached_data = AppleMusicService.enrich_chart_data(cached_data)
-            
         # Add note if we're rate limited to inform the client
-        note = "API rate limited, serving cached data" if cache.get("billboard:rate_limited") else None
-        return jsonify({**cached_data, "cached": True, "note": note} if note else {**cached_data, "cached": True})
+        note = "API rate limited, serving cached data" if rate_limited else None
+        return serve_cached(cached_data, include_apple_music, note)
+    
+    # Only one request refreshes a chart at a time - the rest keep serving the cache
+    lock_key = f"{cache_key}:lock"
+    lock_token = acquire_lock(lock_key, REFRESH_LOCK_TIMEOUT)
+    if not lock_token:
+        cached_data = cached_data or cache.get(cache_key)
+        if cached_data:
+            return serve_cached(cached_data, include_apple_music, "Refresh in progress, serving cached data")
+        
+        # Nothing cached yet - share the fetch already in flight instead of making another one
+        cached_data = wait_for_chart(cache_key, lock_key)
+        if cached_data:
+            return serve_cached(cached_data, include_apple_music)
     
     # If we got here, we need to fetch from API
-    url = "https://billboard-charts-api.p.rapidapi.com/chart.php"
-    headers = {
-        "X-RapidAPI-Key": api_key,
-        "X-RapidAPI-Host": "billboard-charts-api.p.rapidapi.com"
-    }
-    params = {'id': chart_id}
-    if week:
-        params['week'] = week
+    params = {'id': chart_id, 'week': week} if week else {'id': chart_id}
     
     try:
         # Make the API request
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        new_data = response.json()
+        with billboard_session.get(BILLBOARD_API_URL, params=params, timeout=BILLBOARD_API_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            new_data = read_json(response)
         
         # Check if API returned an error
         if not isinstance(new_data, dict) or "error" in new_data:
             raise Exception(new_data.get("error", "Invalid API response") if isinstance(new_data, dict) else "Invalid response format")
         
         # Clear rate limit flag if request was successful
-        cache.delete("billboard:rate_limited")
+        if rate_limited:
+            set_rate_limited(False)
         
-        # Add Apple Music data if requested
-        if include_apple_music:
-            new_data = AppleMusicService.enrich_chart_data(new_data)
-        
-        # Cache historical data permanently (specific week)
+        # Cache historical data permanently (specific week) - a timeout of 0 sets no TTL
         if week:
-            cache.set(cache_key, new_data, timeout=None)
-            return jsonify({**new_data, "cached": False})
+            # A chart with lookups still outstanding is refetched in an hour rather than kept for good
+            complete = True
+            if include_apple_music:
+                new_data, complete = AppleMusicService.enrich_chart_data(new_data)
+            timeout = 0 if complete else jittered_timeout(ONE_HOUR)
+            encoded = cache_chart(cache_key, new_data, timeout, include_apple_music and complete)
+            return Response(splice_json(encoded, FRESH_FIELDS), mimetype="application/json")
         
         # For current charts - check if data changed (only on Tuesdays)
-        is_tuesday = datetime.now().weekday() == 1
-        if is_tuesday and cached_data and not refresh:
-            old_date = cached_data.get("chart", {}).get("date")
+        if check_for_update and (cached_data or cached_date) and not refresh:
+            old_date = cached_date or cached_data.get("chart", {}).get("date")
             new_date = new_data.get("chart", {}).get("date")
             
             # If dates match, the chart hasn't been updated yet despite being Tuesday
             if old_date == new_date:
-                # Data hasn't changed, check again in an hour
-                # Make sure cached data has Apple Music info if requested
-                if include_apple_music:
-                    cached_data = AppleMusicService.enrich_chart_data(cached_data)
-                cache.set(cache_key, cached_data, timeout=ONE_HOUR)
-                return jsonify({**cached_data, "cached": True, "note": "No new chart data yet"})
+                # Only now is the full cached chart needed, to serve it
+                cached_data = cached_data or cache.get(cache_key)
+                if cached_data:
+                    # Data hasn't changed, check again in an hour
+                    # Make sure cached data has Apple Music info if requested
+                    if include_apple_music and not AppleMusicService.is_enriched(cached_data):
+                        cached_data, complete = AppleMusicService.enrich_chart_data(cached_data)
+                        cache_chart(cache_key, cached_data, jittered_timeout(ONE_HOUR), complete)
+                    else:
+                        # Payload is unchanged - only shorten its TTL instead of rewriting it
+                        expire([cache_key, f"{cache_key}:json", date_key], jittered_timeout(ONE_HOUR))
+                    cached_data.update(cached=True, note="No new chart data yet")
+                    return json_response(cached_data)
+        
+        # Only new or changed charts are worth enriching
+        complete = True
+        if include_apple_music:
+            new_data, complete = AppleMusicService.enrich_chart_data(new_data)
         
-        # New or changed data - cache for a week
-        cache.set(cache_key, new_data, timeout=ONE_WEEK)
-        return jsonify({**new_data, "cached": False})
+        # New or changed data - cache for a week, or an hour if some lookups are still outstanding
+        # The chart is encoded once, for both the cached body and this response
+        timeout = jittered_timeout(ONE_WEEK if complete else ONE_HOUR)
+        encoded = cache_chart(cache_key, new_data, timeout, include_apple_music and complete)
+        return Response(splice_json(encoded, FRESH_FIELDS), mimetype="application/json")
         
     except requests.exceptions.HTTPError as e:
         # Handle HTTP errors (4xx, 5xx)
         logger.error(f"HTTP Error: {e}")
+        status_code = e.response.status_code
         
         # Handle rate limiting specifically
-        if response.status_code == 429:
+        if status_code == 429:
             # Set rate limit flag to prevent hammering the API
-            cache.set("billboard:rate_limited", True, timeout=RATE_LIMIT_TIMEOUT)
+            set_rate_limited(True)
             message = "API rate limit exceeded"
         else:
-            message = f"API error: Status code {response.status_code}"
+            message = f"API error: Status code {status_code}"
             
         # Fall back to cached data if available
-        if cached_data:
-            if include_apple_music:
-                cached_data = AppleMusicService.enrich_chart_data(cached_data)
-            return jsonify({**cached_data, "cached": True, "note": f"{message}, serving cached data"})
-        return jsonify({"error": message, "cached": False, "status_code": response.status_code}), 503
+        return (serve_cached(cached_data or cache.get(cache_key), include_apple_music, f"{message}, serving cached data")
+                or json_response({"error": message, "cached": False, "status_code": status_code}, 503))
         
     except (requests.exceptions.RequestException, ValueError) as e:
         # Handles connection, timeout, and JSON parsing errors
@@ -352,11 +1095,8 @@ def get_chart():
         logger.error(f"{error_type}: {error_message}")
         
         # Fall back to cached data if available
-        if cached_data:
-            if include_apple_music:
-                cached_data = AppleMusicService.enrich_chart_data(cached_data)
-            return jsonify({**cached_data, "cached": True, "note": f"{error_type}: {error_message}, serving cached data"})
-        return jsonify({"error": f"{error_type}: {error_message}", "cached": False}), 503
+        return (serve_cached(cached_data or cache.get(cache_key), include_apple_music, f"{error_type}: {error_message}, serving cached data")
+                or json_response({"error": f"{error_type}: {error_message}", "cached": False}, 503))
         
     except Exception as e:
         # Catch-all for any other errors
@@ -364,8 +1104,10 @@ def get_chart():
         logger.error(f"Unexpected error: {error_message}")
         
         # Fall back to cached data if available
-        if cached_data:
-            if include_apple_music:
-                cached_data = AppleMusicService.enrich_chart_data(cached_data)
-            return jsonify({**cached_data, "cached": True, "note": f"{error_message}, serving cached data"})
-        return jsonify({"error": error_message, "cached": False}), 503
\ No newline at end of file
+        return (serve_cached(cached_data or cache.get(cache_key), include_apple_music, f"{error_message}, serving cached data")
+                or json_response({"error": error_message, "cached": False}, 503))
+        
+    finally:
+        # Let the next request refresh this chart - unless the lock expired and is now someone else's
+        if lock_token:
+            release_lock(lock_key, lock_token)
\ No newline at end of file
@@ -1,4 +1,200 @@
+import pickle
+import secrets
+
+import orjson
+import redis
+from cachelib.serializers import RedisSerializer
 from flask_caching import Cache
+from flask_caching.backends.rediscache import RedisCache
 
 # Create cache instance for global use
-cache = Cache()
\ No newline at end of file
+cache = Cache()
+
+# Deletes a lock only while it still holds the caller's token, so a holder whose
+# lock already expired can't release a lock another request has acquired since
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Keys fetched per SCAN step and deleted per UNLINK when clearing the cache
+CLEAR_BATCH_SIZE = 500
+
+class OrjsonSerializer(RedisSerializer):
+    """
+    Serialize cache values as JSON with orjson instead of pickle.
+    
+    Chart payloads are plain JSON data, and orjson encodes and decodes them
+    several times faster than pickle. Raw bytes (pre-serialized response
+    bodies) are stored as-is behind a marker byte. Anything orjson can't
+    encode, and values written before the switch, still go through pickle,
+    which RedisSerializer marks with a leading "!".
+    """
+    
+    BYTES_MARKER = b"~"
+    
+    def dumps(self, value, protocol=pickle.HIGHEST_PROTOCOL):
+        if isinstance(value, bytes):
+            return self.BYTES_MARKER + value
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            return super().dumps(value, protocol)
+    
+    def loads(self, value):
+        if value is None:
+            return None
+        if value.startswith(self.BYTES_MARKER):
+            return value[1:]
+        if value.startswith(b"!"):
+            return super().loads(value)
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            return super().loads(value)
+
+class OrjsonRedisCache(RedisCache):
+    """Flask-Caching RedisCache backend that serializes values with orjson."""
+    
+    serializer = OrjsonSerializer()
+    
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        """
+        Build the backend, bounding its connection pool when CACHE_REDIS_MAX_CONNECTIONS is set.
+        
+        RedisCache ignores CACHE_OPTIONS once CACHE_REDIS_URL is given, so the
+        client is created here and handed over as CACHE_REDIS_HOST instead.
+        Callers wait up to CACHE_REDIS_POOL_TIMEOUT seconds for a free
+        connection rather than failing when the pool is exhausted.
+        """
+        redis_url = config.get("CACHE_REDIS_URL")
+        max_connections = config.get("CACHE_REDIS_MAX_CONNECTIONS")
+        if redis_url and max_connections:
+            pool = redis.BlockingConnectionPool.from_url(
+                redis_url,
+                max_connections=max_connections,
+                timeout=config.get("CACHE_REDIS_POOL_TIMEOUT", 5)
+            )
+            config = dict(config, CACHE_REDIS_URL=None, CACHE_REDIS_HOST=redis.Redis(connection_pool=pool))
+        return super().factory(app, config, args, kwargs)
+    
+    def clear(self):
+        """
+        Delete every key under this cache's prefix.
+        
+        RedisCache.clear() lists the keys with a single KEYS call, which
+        blocks the whole Redis server while it walks the keyspace - including
+        for other processes sharing it. SCAN walks it in small batches instead,
+        and UNLINK frees the values in the background.
+        
+        Returns:
+            bool: True if any keys were deleted
+        """
+        if not self.key_prefix:
+            return super().clear()
+        
+        deleted = 0
+        batch = []
+        for key in self._read_client.scan_iter(match=f"{self.key_prefix}*", count=CLEAR_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == CLEAR_BATCH_SIZE:
+                deleted += self._write_client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self._write_client.unlink(*batch)
+        return bool(deleted)
+
+def acquire_lock(key, timeout):
+    """
+    Atomically create a short-lived lock key if it doesn't already exist.
+    
+    Uses a single Redis SET NX EX so the lock can never be left behind
+    without an expiry. The lock holds a random token identifying its holder,
+    which release_lock() checks. Other backends fall back to cache.add().
+    
+    Args:
+        key (str): The lock key
+        timeout (int): Seconds before the lock expires on its own
+        
+    Returns:
+        str: The holder's token for release_lock(), or None if someone else holds the lock
+    """
+    token = secrets.token_hex(16)
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is None:
+        return token if cache.add(key, token, timeout=timeout) else None
+    # Stored serialized like any cached value, so the lock can still be read with cache.get()
+    value = backend.serializer.dumps(token)
+    return token if client.set(backend.key_prefix + key, value, nx=True, ex=timeout) else None
+
+def release_lock(key, token):
+    """
+    Delete a lock, but only if it is still held by the given token.
+    
+    On Redis the check and delete run as one script, so they can't
+    interleave with another request acquiring the lock. Other backends
+    fall back to a (non-atomic) get and delete.
+    
+    Args:
+        key (str): The lock key
+        token (str): The token returned by acquire_lock()
+        
+    Returns:
+        bool: True if the lock was released, False if it had expired or changed hands
+    """
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is None:
+        if cache.get(key) != token:
+            return False
+        return bool(cache.delete(key))
+    return bool(client.eval(RELEASE_LOCK_SCRIPT, 1, backend.key_prefix + key, backend.serializer.dumps(token)))
+
+def encoded_value(value, encoded):
+    """
+    Hand the cache a value's existing orjson encoding, so it isn't encoded again.
+    
+    OrjsonSerializer passes an orjson.Fragment through as-is, and reading
+    it back decodes the JSON into a dict like any other cached value.
+    Other backends can't store a Fragment, so they get the value itself.
+    
+    Args:
+        value: The value to cache
+        encoded (bytes): The value already encoded with orjson.dumps()
+        
+    Returns:
+        The Fragment to cache, or the original value for other backends
+    """
+    if isinstance(getattr(cache.cache, "serializer", None), OrjsonSerializer):
+        return orjson.Fragment(encoded)
+    return value
+
+def expire(keys, timeout):
+    """
+    Reset the TTL of existing keys without rewriting their values.
+    
+    On Redis this only sends EXPIRE commands in one pipeline, so large
+    payloads don't have to be serialized and sent again. Other backends
+    fall back to re-setting each value.
+    
+    Args:
+        keys (list): The keys to update
+        timeout (int): The new timeout in seconds
+    """
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is None:
+        for key in keys:
+            value = backend.get(key)
+            if value is not None:
+                backend.set(key, value, timeout=timeout)
+        return
+    
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.expire(backend.key_prefix + key, timeout)
+    pipe.execute()
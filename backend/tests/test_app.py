@@ -1,15 +1,7 @@
 import pytest
 from flask import Flask
-from app import create_app
 from cache_extension import cache
 
-@pytest.fixture
-def app():
-    """Create Flask app for testing"""
-    app = create_app()
-    app.config['TESTING'] = True
-    return app
-
 def test_app_creation(app):
     """Test that the Flask app is created correctly"""
     # Verify app is a Flask instance with the expected name
@@ -36,10 +28,20 @@ def test_blueprint_registration(app):
     assert 'billboard.get_chart' in rules
     
 @pytest.mark.parametrize("config_key,expected_value", [
-    ('CACHE_TYPE', 'RedisCache'),
-    ('CACHE_DEFAULT_TIMEOUT', 3600)
+    ('CACHE_TYPE', 'cache_extension.OrjsonRedisCache'),
+    ('CACHE_DEFAULT_TIMEOUT', 3600),
+    ('CACHE_REDIS_MAX_CONNECTIONS', 50)
 ])
 def test_cache_config(app, config_key, expected_value):
     """Test cache configuration is properly set up"""
     assert app.config[config_key] == expected_value
-    assert 'CACHE_REDIS_URL' in app.config
\ No newline at end of file
+    assert 'CACHE_REDIS_URL' in app.config
+
+def test_cache_connection_pool(app):
+    """Test that the Redis client uses a bounded connection pool"""
+    if not app.config.get('CACHE_REDIS_URL'):
+        pytest.skip("REDIS_URL not set")
+    
+    with app.app_context():
+        pool = cache.cache._write_client.connection_pool
+        assert pool.max_connections == 50
@@ -1,29 +1,82 @@
 import pytest
 import requests
+import io
 import json
-from datetime import datetime
-from freezegun import freeze_time
-from app import create_app
-from cache_extension import cache
-from test_data import TEST_CHART_IDS, ERROR_SCENARIOS
+import threading
+import time
+import responses
+from urllib.parse import parse_qs, urlparse
+from cache_extension import cache, acquire_lock, release_lock
+from blueprints.billboard_api import (AppleMusicService, apple_music_session, billboard_session, cache_chart,
+                                      extend_json, read_json, set_rate_limited, splice_json,
+                                      APPLE_MUSIC_MAX_WORKERS, APPLE_MUSIC_SEARCH_TIMEOUT, APPLE_MUSIC_SEARCH_URL,
+                                      BILLBOARD_API_URL, ONE_HOUR,
+                                      REFRESH_FETCH_TIMEOUT, REFRESH_LOCK_TIMEOUT, REFRESH_WAIT_TIMEOUT, WORKER_TIMEOUT)
+from test_data import TEST_CHART_IDS, TEST_CHARTS, ERROR_SCENARIOS
+
+def chart_callback(request):
+    """Answer a mocked Billboard API request from TEST_CHARTS"""
+    query = parse_qs(urlparse(request.url).query)
+    chart_id = query["id"][0]
+    if chart_id not in TEST_CHARTS:
+        return 200, {}, json.dumps({"error": f"Chart {chart_id} not found"})
+    chart = TEST_CHARTS[chart_id]["chart"]
+    if "week" in query:
+        chart = dict(chart, date=query["week"][0])
+    return 200, {}, json.dumps({"chart": chart})
+
+@pytest.fixture(scope="module")
+def upstream_apis():
+    """Intercept HTTP for the whole module, so no test here reaches the real APIs"""
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        yield rsps
+
+@pytest.fixture(autouse=True)
+def mock_billboard_api(upstream_apis):
+    """Serve charts from canned payloads, with no Apple Music matches, instead of the network"""
+    upstream_apis.add_callback(responses.GET, BILLBOARD_API_URL, callback=chart_callback)
+    upstream_apis.add(responses.GET, APPLE_MUSIC_SEARCH_URL, json={"results": {}})
+    yield upstream_apis
+    upstream_apis.reset()
+
+@pytest.fixture
+def cached_hot100(app_context):
+    """Seed the cache with the canned Hot 100 chart, as a completed fetch leaves it"""
+    cache_chart("billboard:hot-100", TEST_CHARTS["hot-100"], 3600, enriched=False)
+
+@pytest.fixture
+def tuesday(monkeypatch):
+    """Make the route see a Tuesday, when current charts are checked for a new week"""
+    monkeypatch.setattr('blueprints.billboard_api.weekday_now', lambda: 1)
 
 @pytest.fixture
-def client():
-    """Create Flask test client"""
-    app = create_app()
-    app.config['TESTING'] = True
-    with app.test_client() as client:
-        with app.app_context():
-            cache.clear()
-            yield client
-            # Clean up after test
-            cache.clear()
+def monday(monkeypatch):
+    """Make the route see a Monday, when current charts are served straight from cache"""
+    monkeypatch.setattr('blueprints.billboard_api.weekday_now', lambda: 0)
+
+def ok_response(payload, status_code=200):
+    """Build a streamed API response carrying the given JSON payload"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(payload).encode('utf-8'))
+    return response
+
+def error_response(status_code, message):
+    """Build an API error response, as returned for rate limits and server errors"""
+    return ok_response({"error": message}, status_code)
+
+class TrackedBody(io.BytesIO):
+    """A response body that records whether its connection was handed back to the pool"""
+    released = False
+    
+    def release_conn(self):
+        self.released = True
 
 def test_get_default_chart(client):
     """Test getting the default Hot 100 chart"""
     # Act
     response = client.get('/billboard_api.php')
-    data = json.loads(response.data)
+    data = response.get_json()
     
     # Assert
     assert response.status_code == 200
@@ -37,15 +90,12 @@ def test_get_chart_by_id(client, chart_id):
     # Act
     response = client.get(f'/billboard_api.php?id={chart_id}')
     
+    data = response.get_json()
+    
     # Assert
-    if response.status_code == 200:
-        data = json.loads(response.data)
-        assert 'chart' in data
-        assert 'entries' in data['chart']
-    else:
-        # Some chart IDs might not be valid, but response should be properly formed
-        data = json.loads(response.data)
-        assert 'error' in data
+    assert response.status_code == 200
+    assert data['chart']['name'] == TEST_CHARTS[chart_id]['chart']['name']
+    assert len(data['chart']['entries']) > 0
 
 def test_historical_chart_caching(client):
     """Test getting and caching a chart for a specific week"""
@@ -55,7 +105,7 @@ def test_historical_chart_caching(client):
     
     # Act - First request
     response1 = client.get(url)
-    data1 = json.loads(response1.data)
+    data1 = response1.get_json()
     
     # Assert - First request not cached
     assert response1.status_code == 200
@@ -63,7 +113,7 @@ def test_historical_chart_caching(client):
     
     # Act - Second request
     response2 = client.get(url)
-    data2 = json.loads(response2.data)
+    data2 = response2.get_json()
     
     # Assert - Second request should be cached
     assert response2.status_code == 200
@@ -76,33 +126,26 @@ def test_refresh_parameter(client):
     
     # Act - Then request with refresh=true
     response = client.get('/billboard_api.php?refresh=true')
-    data = json.loads(response.data)
+    data = response.get_json()
     
     # Assert
     assert response.status_code == 200
     assert not data['cached']
 
-@freeze_time("2025-04-15")  # A Tuesday
-def test_tuesday_refresh(client):
+def test_tuesday_refresh(client, tuesday):
     """Test Tuesday chart update behavior"""
-    # Arrange - First request to populate cache
-    client.get('/billboard_api.php')
+    # Arrange - Cache last week's chart
+    cache_chart("billboard:hot-100", {"chart": dict(TEST_CHARTS["hot-100"]["chart"], date="2025-04-01")}, 3600, enriched=False)
     
-    # Act - Modify cache to simulate old data
-    with client.application.app_context():
-        cached_data = cache.get("billboard:hot-100")
-        if cached_data and "chart" in cached_data:
-            cached_data["chart"]["date"] = "2025-04-08"  # Previous Tuesday
-            cache.set("billboard:hot-100", cached_data)
-    
-    # Act - Second request
+    # Act
     response = client.get('/billboard_api.php')
-    data = json.loads(response.data)
+    data = response.get_json()
     
-    # Assert - Either new data or note about no updates
+    # Assert - The new week is fetched, not served from cache
     assert response.status_code == 200
-    if data.get('cached', False):
-        assert "note" in data and "No new chart data yet" in data["note"]
+    assert not data['cached']
+    assert data['chart']['date'] == "2025-04-08"
+    assert 'note' not in data
 
 @pytest.mark.parametrize("apple_music_param", ["true", "false"])
 def test_apple_music_parameter(client, apple_music_param):
@@ -112,40 +155,29 @@ def test_apple_music_parameter(client, apple_music_param):
     
     # Assert
     assert response.status_code == 200
-    data = json.loads(response.data)
+    data = response.get_json()
     assert 'chart' in data
 
-@pytest.mark.parametrize("error_type,status_code", [
-    ("rate_limit", 429),
-    ("server_error", 500)
-])
-def test_error_handling(client, monkeypatch, error_type, status_code):
-    """Test handling of API errors with fallback to cache"""
-    # Arrange - First successful request to populate cache
-    response = client.get('/billboard_api.php')
-    assert response.status_code == 200
+@pytest.mark.parametrize("error_type", ["rate_limit", "server_error", "timeout", "connection_error"])
+def test_error_handling(client, cached_hot100, monkeypatch, error_type):
+    """Test handling of API error statuses and request exceptions with fallback to cache"""
+    # Arrange - Have the API answer with an error status, or fail outright
+    scenario = ERROR_SCENARIOS[error_type]
+    exception_types = {
+        "timeout": requests.exceptions.Timeout,
+        "connection_error": requests.exceptions.ConnectionError
+    }
     
-    # Mock error response
-    class MockResponse:
-        def __init__(self):
-            self.status_code = status_code
-            self._content = json.dumps({"error": f"{error_type} error"}).encode('utf-8')
-            
-        def json(self):
-            return json.loads(self._content)
-            
-        def raise_for_status(self):
-            raise requests.exceptions.HTTPError(f"{status_code} Error", response=self)
-    
-    # Arrange - Setup monkeypatch
-    def mock_error_response(*args, **kwargs):
-        raise requests.exceptions.HTTPError(f"{status_code} Error", response=MockResponse())
-    
-    monkeypatch.setattr(requests, 'get', mock_error_response)
-    
-    # Act - Make request that should trigger error
-    response = client.get('/billboard_api.php')
-    data = json.loads(response.data)
+    def mock_failure(*args, **kwargs):
+        if error_type in exception_types:
+            raise exception_types[error_type](scenario["message"])
+        return error_response(scenario["status_code"], scenario["message"])
+    
+    monkeypatch.setattr(billboard_session, 'get', mock_failure)
+    
+    # Act - Force a refresh, so the request reaches the failing API
+    response = client.get('/billboard_api.php?refresh=true')
+    data = response.get_json()
     
     # Assert - Should return cached data with note
     assert response.status_code == 200
@@ -154,29 +186,268 @@ def test_error_handling(client, monkeypatch, error_type, status_code):
     
     # Special assertion for rate limiting
     if error_type == "rate_limit":
-        with client.application.app_context():
-            assert cache.get("billboard:rate_limited") is True
+        assert cache.get("billboard:rate_limited") is True
 
-@pytest.mark.parametrize("exception_type", ["timeout", "connection"])
-def test_exception_handling(client, monkeypatch, exception_type):
-    """Test handling of request exceptions"""
-    # Arrange - First successful request to populate cache
-    client.get('/billboard_api.php')
+def test_refresh_lock_serves_cached_data(client, sample_chart_data):
+    """Test that a refresh already in progress serves cached data instead of calling the API"""
+    # Arrange - Seed the cache and hold the refresh lock
+    cache.set("billboard:hot-100", sample_chart_data)
+    assert acquire_lock("billboard:hot-100:lock", 30)
+    
+    # Act
+    response = client.get('/billboard_api.php?refresh=true&apple_music=false')
+    data = response.get_json()
+    
+    # Assert - Should use cached data without calling the API
+    assert response.status_code == 200
+    assert data['cached']
+    assert data['note'] == "Refresh in progress, serving cached data"
+    assert data['chart'] == sample_chart_data['chart']
+
+@pytest.mark.parametrize("apple_music_param", ["true", "false"])
+def test_cached_response_body(client, monday, sample_chart_data, apple_music_param):
+    """Test that an enriched chart is served from its pre-serialized response body"""
+    # Arrange - Seed the chart and its serialized body
+    cache_chart("billboard:hot-100", sample_chart_data, 3600, enriched=True)
+    body = cache.get("billboard:hot-100:json")
+    
+    # Act
+    response = client.get(f'/billboard_api.php?apple_music={apple_music_param}')
     
-    # Arrange - Setup exception
-    if exception_type == "timeout":
-        mock_exception = requests.exceptions.Timeout("Connection timed out")
+    # Assert - Body is returned byte for byte
+    assert response.status_code == 200
+    assert response.data == body
+    assert response.get_json()['cached']
+
+@pytest.mark.parametrize("max_bytes,should_parse", [
+    (1024, True),
+    (8, False)
+])
+def test_read_json_size_limit(max_bytes, should_parse):
+    """Test that streamed upstream bodies are parsed unless they exceed the size limit"""
+    # Arrange
+    response = requests.Response()
+    response.raw = io.BytesIO(b'{"chart": {"entries": []}}')
+    
+    # Act & Assert
+    if should_parse:
+        assert read_json(response, max_bytes) == {"chart": {"entries": []}}
     else:
-        mock_exception = requests.exceptions.ConnectionError("Connection failed")
+        with pytest.raises(ValueError):
+            read_json(response, max_bytes)
+
+def test_tuesday_unchanged_chart(client, monkeypatch, tuesday, sample_chart_data):
+    """Test that an unchanged Tuesday chart is compared by date and only the cached copy is enriched"""
+    # Arrange - Cache the chart and have the API return the same chart date
+    cache_chart("billboard:hot-100", sample_chart_data, 3600, enriched=False)
+    assert cache.get("billboard:hot-100:date") == sample_chart_data["chart"]["date"]
     
-    # Arrange - Setup monkeypatch
-    monkeypatch.setattr(requests, 'get', lambda *args, **kwargs: (_ for _ in ()).throw(mock_exception))
+    enriched = []
+    monkeypatch.setattr(billboard_session, 'get', lambda *args, **kwargs: ok_response(sample_chart_data))
+    monkeypatch.setattr(AppleMusicService, 'enrich_chart_data', lambda data: (enriched.append(data) or data, True))
     
     # Act
     response = client.get('/billboard_api.php')
-    data = json.loads(response.data)
+    data = response.get_json()
     
-    # Assert - Should use cached data
+    # Assert - Cached data is served and the fresh copy is never enriched
     assert response.status_code == 200
     assert data['cached']
-    assert 'note' in data
\ No newline at end of file
+    assert data['note'] == "No new chart data yet"
+    assert len(enriched) == 1
+
+def test_tuesday_refresh_sequence(client, monkeypatch, tuesday, sample_chart_data):
+    """Test that Tuesday requests keep serving the cached chart until the API has a newer one"""
+    # Arrange - The API returns last week's chart twice, then this week's
+    new_chart = {"chart": dict(sample_chart_data["chart"], date="2025-04-15")}
+    api_responses = iter([
+        ok_response(sample_chart_data),
+        ok_response(sample_chart_data),
+        ok_response(new_chart)
+    ])
+    monkeypatch.setattr(billboard_session, 'get', lambda *args, **kwargs: next(api_responses))
+    
+    # Act
+    first, second, third = (client.get('/billboard_api.php?apple_music=false').get_json() for _ in range(3))
+    
+    # Assert - Fresh chart, then the unchanged cached copy, then the new chart
+    assert not first['cached']
+    assert second['cached']
+    assert second['note'] == "No new chart data yet"
+    assert not third['cached']
+    assert third['chart']['date'] == "2025-04-15"
+
+def test_tuesday_new_chart_skips_cached_chart(client, monkeypatch, tuesday, sample_chart_data):
+    """Test that a Tuesday request for a new week compares dates without loading the old cached chart"""
+    # Arrange - Cache last week's chart and have the API return this week's
+    cache_chart("billboard:hot-100", sample_chart_data, 3600, enriched=False)
+    new_chart = {"chart": dict(sample_chart_data["chart"], date="2025-04-15")}
+    monkeypatch.setattr(billboard_session, 'get', lambda *args, **kwargs: ok_response(new_chart))
+    
+    cache_get = cache.get
+    def guarded_get(key):
+        assert key != "billboard:hot-100", "loaded the cached chart it was about to replace"
+        return cache_get(key)
+    monkeypatch.setattr(cache, 'get', guarded_get)
+    
+    # Act
+    response = client.get('/billboard_api.php?apple_music=false')
+    data = response.get_json()
+    
+    # Assert
+    assert response.status_code == 200
+    assert not data['cached']
+    assert data['chart']['date'] == "2025-04-15"
+
+def test_extend_json():
+    """Test that fields are spliced into a serialized JSON object"""
+    body = extend_json(b'{"chart":{"entries":[]}}', cached=True, note="Note")
+    
+    assert json.loads(body) == {"chart": {"entries": []}, "cached": True, "note": "Note"}
+
+@pytest.mark.parametrize("body,expected", [
+    (b'{"chart":{}}', {"chart": {}, "cached": False}),
+    (b'{}', {"cached": False})
+])
+def test_splice_json(body, expected):
+    """Test that pre-encoded fields are merged into serialized JSON objects, including empty ones"""
+    assert json.loads(splice_json(body, b'{"cached":false}')) == expected
+
+def test_rate_limited_cached_response_body(client, sample_chart_data):
+    """Test that a rate limited request gets the pre-serialized body with a note added"""
+    # Arrange
+    cache_chart("billboard:hot-100", sample_chart_data, 3600, enriched=True)
+    set_rate_limited(True)
+    
+    # Act
+    response = client.get('/billboard_api.php')
+    data = response.get_json()
+    
+    # Assert
+    assert response.status_code == 200
+    assert data['cached']
+    assert data['note'] == "API rate limited, serving cached data"
+    assert data['chart'] == sample_chart_data['chart']
+
+def test_refresh_lock_waits_for_chart(client, monkeypatch, sample_chart_data):
+    """Test that a request with nothing cached waits for the fetch already in flight"""
+    # Arrange - Hold the refresh lock and cache the chart shortly afterwards
+    assert acquire_lock("billboard:hot-100:lock", 30)
+    monkeypatch.setattr(billboard_session, 'get',
+                       lambda *args, **kwargs: pytest.fail("billboard_session.get called while a fetch was in flight"))
+    
+    def finish_fetch():
+        with client.application.app_context():
+            cache_chart("billboard:hot-100", sample_chart_data, 3600, enriched=False)
+            cache.delete("billboard:hot-100:lock")
+    
+    timer = threading.Timer(0.3, finish_fetch)
+    timer.start()
+    
+    # Act
+    response = client.get('/billboard_api.php?apple_music=false')
+    timer.join()
+    data = response.get_json()
+    
+    # Assert
+    assert response.status_code == 200
+    assert data['cached']
+    assert data['chart'] == sample_chart_data['chart']
+
+def test_refresh_keeps_newer_lock(client, monkeypatch, sample_chart_data):
+    """Test that a slow refresh doesn't release a lock another request acquired after its own expired"""
+    # Arrange - While the fetch runs, the lock expires and another request takes it
+    other_tokens = []
+    
+    def slow_get(*args, **kwargs):
+        cache.delete("billboard:hot-100:lock")
+        other_tokens.append(acquire_lock("billboard:hot-100:lock", 30))
+        return ok_response(sample_chart_data)
+    
+    monkeypatch.setattr(billboard_session, 'get', slow_get)
+    
+    # Act
+    response = client.get('/billboard_api.php?refresh=true&apple_music=false')
+    
+    # Assert - The other request still holds its lock
+    assert response.status_code == 200
+    assert cache.get("billboard:hot-100:lock") == other_tokens[0]
+    assert release_lock("billboard:hot-100:lock", other_tokens[0])
+
+def test_refresh_timing_fits_worker_timeout():
+    """Test that the refresh lock outlives a refresh, and waiting plus fetching beats gunicorn's timeout"""
+    assert REFRESH_LOCK_TIMEOUT > REFRESH_FETCH_TIMEOUT
+    assert REFRESH_WAIT_TIMEOUT > 0
+    assert REFRESH_WAIT_TIMEOUT + REFRESH_FETCH_TIMEOUT < WORKER_TIMEOUT
+
+def test_billboard_error_releases_connection(client, cached_hot100, monkeypatch):
+    """Test that an error status from the Billboard API still returns its connection to the pool"""
+    # Arrange
+    response = error_response(500, "Internal Server Error")
+    response.raw = TrackedBody(response.raw.getvalue())
+    monkeypatch.setattr(billboard_session, 'get', lambda *args, **kwargs: response)
+    
+    # Act
+    result = client.get('/billboard_api.php?refresh=true&apple_music=false')
+    
+    # Assert
+    assert result.status_code == 200
+    assert response.raw.released
+
+def test_apple_music_error_releases_connection(app_context, monkeypatch):
+    """Test that a rejected Apple Music search still returns its connection to the pool"""
+    # Arrange
+    response = error_response(401, "Unauthorized")
+    response.raw = TrackedBody(response.raw.getvalue())
+    monkeypatch.setattr(AppleMusicService, 'get_token', lambda *args, **kwargs: "test-token")
+    monkeypatch.setattr(apple_music_session, 'get', lambda *args, **kwargs: response)
+    
+    # Act
+    result, timeout = AppleMusicService._search_api("song", "artist")
+    
+    # Assert
+    assert result is None
+    assert response.raw.released
+
+def test_apple_music_pool_never_blocks():
+    """Test that lookups never wait on a busy connection pool, since that wait can't be bounded"""
+    adapter = apple_music_session.get_adapter(APPLE_MUSIC_SEARCH_URL)
+    assert adapter.poolmanager.connection_pool_kw["block"] is False
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == APPLE_MUSIC_MAX_WORKERS
+
+def test_incomplete_enrichment_cached_briefly(client, monkeypatch):
+    """Test that a chart whose lookups time out is cached briefly without a body, and late results are kept"""
+    # Arrange - Lookups only finish once the enrichment deadline has passed
+    finish = threading.Event()
+    def slow_search(title, artist):
+        finish.wait(5)
+        return {"id": title}, APPLE_MUSIC_SEARCH_TIMEOUT
+    
+    cached_charts = []
+    def record_cache_chart(cache_key, data, timeout, enriched):
+        cached_charts.append((cache_key, timeout, enriched))
+        return cache_chart(cache_key, data, timeout, enriched)
+    
+    monkeypatch.setattr(AppleMusicService, '_search_api', slow_search)
+    monkeypatch.setattr('blueprints.billboard_api.APPLE_MUSIC_ENRICH_TIMEOUT', 0.1)
+    monkeypatch.setattr('blueprints.billboard_api.cache_chart', record_cache_chart)
+    
+    # Act
+    response = client.get('/billboard_api.php?week=2022-01-01')
+    finish.set()
+    
+    # Assert - The chart expires within the hour and has no cached body
+    assert response.status_code == 200
+    assert not AppleMusicService.is_enriched(response.get_json())
+    [(cache_key, timeout, enriched)] = cached_charts
+    assert 0 < timeout <= ONE_HOUR * 1.05
+    assert not enriched
+    assert cache.get(f"{cache_key}:json") is None
+    
+    # Assert - The lookups still cache their results when they finish
+    search_key = AppleMusicService.search_cache_key("test song 1", "test artist 1")
+    for _ in range(50):
+        if cache.get(search_key) is not None:
+            break
+        time.sleep(0.05)
+    assert cache.get(search_key) == {"id": "Test Song 1"}
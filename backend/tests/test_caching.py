@@ -1,17 +1,22 @@
 import pytest
-import time
-from app import create_app
-from cache_extension import cache
+import pickle
+import fakeredis
+import orjson
+from cache_extension import cache, acquire_lock, encoded_value, release_lock, CLEAR_BATCH_SIZE, OrjsonSerializer
 
-@pytest.fixture
-def app_context():
-    """Create Flask app context for testing"""
-    app = create_app()
-    app.config['TESTING'] = True
-    with app.app_context():
-        cache.clear()
-        yield
-        cache.clear()
+@pytest.fixture(scope="module")
+def fake_redis():
+    """One in-process Redis double shared by this module's tests"""
+    return fakeredis.FakeRedis()
+
+@pytest.fixture(autouse=True)
+def use_fake_redis(request, app, fake_redis, monkeypatch):
+    """Run cache semantics tests against fakeredis; integration tests keep the real server"""
+    if request.node.get_closest_marker("integration"):
+        return
+    backend = app.extensions["cache"][cache]
+    monkeypatch.setattr(backend, "_write_client", fake_redis)
+    monkeypatch.setattr(backend, "_read_client", fake_redis)
 
 @pytest.mark.parametrize("test_data", [
     "string value",
@@ -50,29 +55,22 @@ def test_cache_timeout(app_context, timeout, should_expire):
     # Assert - Value exists initially
     assert cache.get(test_key) == "test_value"
     
-    # Wait longer than the timeout
-    if timeout:
-        time.sleep(timeout + 0.5)
-    else:
-        time.sleep(0.5)
-    
-    # Assert - Check if value expired as expected
-    result = cache.get(test_key)
+    # Assert - Expiry is enforced by Redis, so check the TTL it was given
+    # instead of sleeping it out
+    ttl_ms = cache.cache._read_client.pttl(cache.cache.key_prefix + test_key)
     if should_expire:
-        assert result is None
+        assert 0 < ttl_ms <= timeout * 1000
     else:
-        assert result == "test_value"
+        assert ttl_ms > 1000
 
 def test_cache_delete(app_context):
     """Test cache deletion operations"""
     # Arrange
-    cache.set("key1", "value1")
-    cache.set("key2", "value2")
+    cache.set_many({"key1": "value1", "key2": "value2"})
     
     # Act & Assert - Delete existing key
     cache.delete("key1")
-    assert cache.get("key1") is None
-    assert cache.get("key2") == "value2"
+    assert cache.get_many("key1", "key2") == [None, "value2"]
     
     # Act & Assert - Delete non-existent key (should not error)
     cache.delete("nonexistent_key")
@@ -80,15 +78,26 @@ def test_cache_delete(app_context):
 def test_cache_clear(app_context):
     """Test clearing the entire cache"""
     # Arrange
-    cache.set("key1", "value1")
-    cache.set("key2", "value2")
+    cache.set_many({"key1": "value1", "key2": "value2"})
     
     # Act
     cache.clear()
     
     # Assert
-    assert cache.get("key1") is None
-    assert cache.get("key2") is None
+    assert cache.get_many("key1", "key2") == [None, None]
+
+def test_cache_clear_keeps_other_prefixes(app_context, fake_redis):
+    """Test that clearing the cache leaves keys outside its prefix alone"""
+    # Arrange - Enough keys to need more than one delete batch
+    cache.set_many({f"key{i}": i for i in range(CLEAR_BATCH_SIZE + 1)})
+    fake_redis.set("other_prefix_key", "value")
+    
+    # Act
+    cache.clear()
+    
+    # Assert
+    assert fake_redis.keys(f"{cache.cache.key_prefix}*") == []
+    assert fake_redis.get("other_prefix_key") == b"value"
 
 @pytest.mark.parametrize("cache_key_pattern,data", [
     ("billboard:hot-100", {"chart": {"name": "Hot 100"}}),
@@ -106,6 +115,22 @@ def test_application_cache_patterns(app_context, cache_key_pattern, data):
     # Assert
     assert result == data
 
+def test_lock_release_requires_owner(app_context):
+    """Test that a lock can only be released by the request holding it"""
+    # Arrange - The first holder's lock expired and another request took it
+    first = acquire_lock("test_lock", 30)
+    cache.delete("test_lock")
+    second = acquire_lock("test_lock", 30)
+    
+    # Act & Assert - Only the current holder can release it
+    assert first and second and first != second
+    assert acquire_lock("test_lock", 30) is None
+    assert not release_lock("test_lock", first)
+    assert cache.get("test_lock") == second
+    assert release_lock("test_lock", second)
+    assert cache.get("test_lock") is None
+
+@pytest.mark.integration
 def test_redis_connectivity(app_context):
     """Test Redis connection is working"""
     try:
@@ -131,7 +156,36 @@ def test_null_values(app_context):
     assert cache.get(null_key) is None  # Explicitly stored None
     assert cache.get(missing_key) is None  # Key doesn't exist
     
-    # Differentiate using get_many
-    many_result = cache.get_many([null_key, missing_key])
-    assert null_key in many_result
-    assert missing_key not in many_result
\ No newline at end of file
+    # A batch lookup returns None for both too, so only has() tells them apart
+    assert cache.get_many(null_key, missing_key) == [None, None]
+    assert cache.has(null_key)
+    assert not cache.has(missing_key)
+
+@pytest.mark.parametrize("value", [
+    {"songs": [{"position": 1, "name": "Song"}], "cached": True},
+    b'{"raw": "body"}',
+    {1, 2, 3}
+])
+def test_orjson_serializer_round_trip(value):
+    """Test the cache serializer round-trips JSON data, raw bytes and pickle fallbacks"""
+    serializer = OrjsonSerializer()
+    
+    assert serializer.loads(serializer.dumps(value)) == value
+    
+def test_encoded_value_stored_as_is(app_context):
+    """Test a pre-encoded value is cached from its existing bytes instead of being encoded again"""
+    # Arrange - Bytes that differ from the value show which of the two was stored
+    data = {"chart": {"entries": []}}
+    encoded = b'{"chart":{"entries":[{"rank":1}]}}'
+    
+    # Act
+    cache.set("encoded_test", encoded_value(data, encoded))
+    
+    # Assert
+    assert cache.get("encoded_test") == orjson.loads(encoded)
+
+def test_orjson_serializer_reads_legacy_pickle():
+    """Test values pickled before the serializer switch are still readable"""
+    legacy = b"!" + pickle.dumps({"key": "value"})
+    
+    assert OrjsonSerializer().loads(legacy) == {"key": "value"}
@@ -1,65 +1,90 @@
 # Test data constants for use across test files
 
-# List of chart IDs to test with (representative sample)
-TEST_CHART_IDS = [
+from types import MappingProxyType
+
+# Chart IDs to test with (representative sample)
+TEST_CHART_IDS = (
     "hot-100",              # Hot 100
     "billboard-200",        # Billboard 200
     "artist-100",           # Artist 100
     "streaming-songs",      # Streaming Songs
     "digital-song-sales"    # Digital Song Sales
-]
+)
+
+# Canned Billboard API responses, keyed by chart ID. Only the top level is
+# read-only: the charts are encoded as JSON and cached as-is, so their nested
+# dicts and lists stay plain - copy them before changing anything.
+TEST_CHARTS = MappingProxyType({
+    chart_id: {
+        "chart": {
+            "name": name,
+            "date": "2025-04-08",
+            "entries": [
+                {"rank": 1, "title": "Test Song 1", "artist": "Test Artist 1", "weeks": 4, "last": 1, "peak": 1},
+                {"rank": 2, "title": "Test Song 2", "artist": "Test Artist 2", "weeks": 10, "last": 2, "peak": 1}
+            ]
+        }
+    }
+    for chart_id, name in (
+        ("hot-100", "Hot 100"),
+        ("billboard-200", "Billboard 200"),
+        ("artist-100", "Artist 100"),
+        ("streaming-songs", "Streaming Songs"),
+        ("digital-song-sales", "Digital Song Sales")
+    )
+})
 
 # Historical dates guaranteed to have data
-HISTORICAL_TEST_DATES = [
+HISTORICAL_TEST_DATES = (
     "2000-01-01",
     "2010-01-02",
     "2020-01-04"
-]
+)
 
-# Error scenarios for testing error handling
-ERROR_SCENARIOS = {
-    "rate_limit": {
+# Error scenarios for testing error handling, read-only all the way down
+ERROR_SCENARIOS = MappingProxyType({
+    "rate_limit": MappingProxyType({
         "status_code": 429,
         "message": "Rate limit exceeded"
-    },
-    "server_error": {
+    }),
+    "server_error": MappingProxyType({
         "status_code": 500,
         "message": "Internal server error"
-    },
-    "timeout": {
+    }),
+    "timeout": MappingProxyType({
         "exception": "requests.exceptions.Timeout",
         "message": "Request timed out"
-    },
-    "connection_error": {
+    }),
+    "connection_error": MappingProxyType({
         "exception": "requests.exceptions.ConnectionError",
         "message": "Connection failed"
-    }
-}
+    })
+})
 
 # Cache key patterns
-CACHE_KEY_PATTERNS = {
+CACHE_KEY_PATTERNS = MappingProxyType({
     "current_chart": "billboard:{chart_id}",
     "historical_chart": "billboard:{chart_id}:{week}",
     "apple_music_token": "apple_music:token",
     "apple_music_search": "apple_music:search:{title}:{artist}",
     "rate_limit_flag": "billboard:rate_limited"
-}
+})
 
 # Test parameters for API requests
-TEST_PARAMETERS = [
+TEST_PARAMETERS = (
     # id, week, refresh, apple_music
     ("hot-100", None, "false", "true"),
     ("billboard-200", None, "false", "true"),
     ("hot-100", "2022-01-01", "false", "true"),
     ("hot-100", None, "true", "true"),
     ("hot-100", None, "false", "false")
-]
+)
 
 # Sample songs for Apple Music tests
-TEST_SONGS = [
+TEST_SONGS = (
     # title, artist, should_exist
     ("Bohemian Rhapsody", "Queen", True),
     ("Stairway to Heaven", "Led Zeppelin", True),
     ("Imagine", "John Lennon", True),
     ("This Is Not A Real Song Title", "Fake Artist Name", False)
-]
\ No newline at end of file
+)
\ No newline at end of file